@@ -23,6 +23,9 @@ class Database():
     def __init__(self, path, **kwargs):
         self.cnn = sqlite3.connect(path)
         self.cnn.row_factory = sqlite3.Row
+        # write-ahead log: cheaper batched commits (readers don't block)
+        self.cnn.execute("PRAGMA journal_mode=WAL")
+        self.cnn.execute("PRAGMA synchronous=NORMAL")
         self.primary_keys = {}
         self.cur = None
     
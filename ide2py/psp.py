@@ -12,9 +12,9 @@ __license__ = "GPL 3.0"
 
 import datetime
 import os, os.path
-import sys
-import hashlib, uuid
-import cPickle as pickle
+import re
+import time
+import uuid
 import wx
 import wx.grid
 from wx.lib.mixins.listctrl import CheckListCtrlMixin, ListCtrlAutoWidthMixin
@@ -31,18 +31,46 @@ except ImportError:
     Camera = None
 
 
+DEBUG = False
+
 PSP_PHASES = ["planning", "design", "code", "review", "compile", "test", "postmortem"]
 PSP_TIMES = ["plan", "actual", "interruption", "off_task", "comments"]
 PSP_DEFECT_TYPES = {10: 'Documentation', 20: 'Synax', 30: 'Build', 
     40: 'Assignment', 50: 'Interface',  60: 'Checking', 70: 'Data', 
     80: 'Function', 90: 'System', 100: 'Enviroment'}
 
-PSP_EVENT_LOG_FORMAT = "%(timestamp)s %(uuid)s %(phase)s %(event)s %(comment)s"
+# precalculated choices (dialog options) and their values:
+PSP_DEFECT_TYPE_KEYS = sorted(PSP_DEFECT_TYPES.keys())
+PSP_DEFECT_TYPE_CHOICES = ["%s: %s" % (k, PSP_DEFECT_TYPES[k])
+                           for k in PSP_DEFECT_TYPE_KEYS]
+PSP_PHASE_CHOICES = [""] + PSP_PHASES
+
+# reverse lookups (value -> position), avoid linear list.index() searches:
+PSP_PHASE_INDEX = dict([(p, i) for i, p in enumerate(PSP_PHASES)])
+PSP_TIME_INDEX = dict([(t, i) for i, t in enumerate(PSP_TIMES)])
+PSP_DEFECT_TYPE_INDEX = dict([(k, i) for i, k in enumerate(PSP_DEFECT_TYPE_KEYS)])
+PSP_PHASE_CHOICE_INDEX = dict([(p, i) for i, p in enumerate(PSP_PHASE_CHOICES)])
+
+PSP_EVENT_LOG_FORMAT = "%s %s %s %s %s\n"  # timestamp uuid phase event comment
+PSP_DEFECT_LOG_FORMAT = "number=%s type=%s phase=%s"   # defect event comment
+PSP_SYNC_INTERVAL = 30      # seconds between buffered database writes
+PSP_LOG_FLUSH_INTERVAL = 5  # seconds between buffered event log writes
+PSP_LOG_BUFFER_SIZE = 64 * 1024
+PSP_TIMER_INTERVAL = 5000   # milliseconds between stopwatch updates
+PSP_MAX_TICK = 3 * PSP_TIMER_INTERVAL / 1000  # max seconds counted per update
 
 ID_START, ID_PAUSE, ID_STOP, ID_CHECK, ID_METADATA, ID_DIFF, ID_PHASE, \
 ID_DEFECT, ID_DEL, ID_DEL_ALL, ID_EDIT, ID_FIXED, ID_WONTFIX, ID_FIX, \
 ID_UP, ID_DOWN, ID_WIKI, ID_COMPILE, ID_TEST \
-    = [wx.NewId() for i in range(19)]
+    = wx.NewIdRef(count=19) if hasattr(wx, "NewIdRef") else \
+      [wx.NewId() for i in range(19)]   # older wx (classic) versions
+
+# user time input: number (dot or comma as decimal separator) and unit
+PSP_TIME_RE = re.compile(r'^\s*([0-9]+(?:[.,][0-9]*)?|[.,][0-9]+)\s*([a-z]*)\s*$',
+                         re.I)
+# unit factors (by initial: s, sec, m, min, h, hours...)
+PSP_TIME_UNITS = {'s': 1, 'm': 60, 'h': 3600}
+PSP_TIME_DEFAULT_FACTOR = 3600  # bare numbers (or unknown units) are hours
 
 WX_VERSION = tuple([int(v) for v in wx.version().split()[0].split(".")])
 
@@ -52,33 +80,31 @@ def pretty_time(counter):
     if counter is None:
         return ""
     counter = int(counter)
-    for factor, unit in ((1., 's'), (60., 'm'), (3600., 'h')):
-        if counter < (60 * factor):
-            break
+    if counter >= 3600:
+        factor, unit = 3600, 'h'
+    elif counter >= 60:
+        factor, unit = 60, 'm'
+    else:
+        factor, unit = 1, 's'
+    quotient, remainder = divmod(counter, factor)
     # only print fraction if it is not an integer result
-    if counter % factor:
-        return "%0.2f %s" % (counter/factor, unit)
+    if remainder:
+        return "%0.2f %s" % (counter / float(factor), unit)
     else:
-        return "%d %s" % (counter/factor, unit)
+        return "%d %s" % (quotient, unit)
 
 def parse_time(user_input):
-    "analyze user input, return a time count number in seconds"
-    # sanity checks on user input:
-    user_input = str(user_input).strip().lower()
-    if not user_input:
+    "analyze user input, return a time count number in seconds (None if invalid)"
+    user_input = str(user_input)
+    if not user_input.strip():
         return 0
-    elif ' ' in user_input:
-        user_time, user_unit = user_input.split()
-    elif not user_input[-1].isdigit():
-        user_time, user_unit = user_input[:-1], user_input[-1]
-    else:
-        user_time, user_unit = user_input, ""
-    # find time unit and convert from it to seconds
-    user_time = user_time.replace(",", ".")
-    for factor, unit in ((1, 's'), (60, 'm'), (3600, 'h')):
-        if unit == user_unit:
-            break
-    return float(user_time) * factor
+    match = PSP_TIME_RE.match(user_input)
+    if not match:
+        return None
+    # convert from the time unit to seconds
+    user_time, user_unit = match.groups()
+    factor = PSP_TIME_UNITS.get(user_unit[:1].lower(), PSP_TIME_DEFAULT_FACTOR)
+    return float(user_time.replace(",", ".")) * factor
 
 
 class PlanSummaryTable(wx.grid.PyGridTableBase):
@@ -87,6 +113,9 @@ class PlanSummaryTable(wx.grid.PyGridTableBase):
         wx.grid.PyGridTableBase.__init__(self)
         self.rows = PSP_PHASES
         self.cols = PSP_TIMES
+        self._dirty = False
+        self._last_flush = time.time()
+        self._last_row = None
         self.Clear()
         self.grid = grid
         self.UpdateValues()
@@ -112,21 +141,32 @@ class PlanSummaryTable(wx.grid.PyGridTableBase):
         key_phase = PSP_PHASES[row]
         key_time = PSP_TIMES[col]
         if self.data is not None:
-            val = self.data.get(key_phase, {}).get(key_time, 0)
-            if key_time != "comments":
-                return pretty_time(val)
-            elif val:
-                return '; '.join(['%s %s' % (msg, pretty_time(delta)) 
-                                    for msg, delta in val])
+            # use the formatted text cache (called on each repaint)
+            key = key_phase, key_time
+            if key not in self._fmt_cache:
+                val = self.data.get(key_phase, {}).get(key_time, 0)
+                if key_time != "comments":
+                    text = pretty_time(val)
+                elif val:
+                    text = '; '.join(['%s %s' % (msg, pretty_time(delta)) 
+                                      for msg, delta in val])
+                else:
+                    text = ''
+                self._fmt_cache[key] = text
+            return self._fmt_cache[key]
         return ''
 
     def SetValue(self, row, col, value):
         if self.data is not None:
             value = parse_time(value)
+            if value is None:
+                return      # invalid input, keep the stored value
             key_phase = PSP_PHASES[row]
             key_time = PSP_TIMES[col]
             self.data.setdefault(key_phase, {})[key_time] = value
-            self.data.sync()
+            self._fmt_cache.pop((key_phase, key_time), None)
+            self._dirty = True
+            self.maybe_flush()
         
     def GetColLabelValue(self, col):
         return self.cols[col].capitalize()
@@ -134,7 +174,7 @@ class PlanSummaryTable(wx.grid.PyGridTableBase):
     def GetRowLabelValue(self, row):
         return self.rows[row].capitalize()
 
-    def count(self, phase, interruption, active=True):
+    def count(self, phase, interruption, active=True, delta=1):
         "Increment actual user time according selected phase"
         if self.data is not None:
             key_phase = phase
@@ -146,14 +186,22 @@ class PlanSummaryTable(wx.grid.PyGridTableBase):
                 key_time = "interruption"
             else:
                 key_time = "actual"
-            value = (self.data.get(phase, {}).get(key_time) or 0) + 1
+            value = (self.data.get(phase, {}).get(key_time) or 0) + delta
             self.data.setdefault(key_phase, {})[key_time] = value
-            self.data.sync()
-            row = PSP_PHASES.index(phase)
-            col = PSP_TIMES.index(key_time)
-            self.UpdateValues(row, col)
-            self.grid.SelectRow(-1)
-            self.grid.SelectRow(row)
+            self._fmt_cache.pop((key_phase, key_time), None)
+            self._dirty = True
+            row = PSP_PHASE_INDEX[phase]
+            col = PSP_TIME_INDEX[key_time]
+            if row != self._last_row:
+                # phase changed: move the cursor and repaint in a single batch
+                self.grid.BeginBatch()
+                self.grid.SetGridCursor(row, col)
+                self.UpdateValues(row, col)
+                self.grid.EndBatch()
+                self._last_row = row
+            else:
+                # same phase: just repaint the cell (EndBatch redraws all)
+                self.UpdateValues(row, col)
             return self.data.get(phase, {})
 
     def comment(self, phase, message, delta):
@@ -163,13 +211,21 @@ class PlanSummaryTable(wx.grid.PyGridTableBase):
         comments = self.data.get(key_phase, {}).get('comments', [])
         comments.append((message, delta))
         self.data[key_phase]['comments'] = comments
-        self.data.sync()
-        row = PSP_PHASES.index(phase)
+        self._fmt_cache.pop((key_phase, 'comments'), None)
+        self._dirty = True
+        row = PSP_PHASE_INDEX[phase]
         self.UpdateValues(row)
         self.grid.SelectRow(row)
         
     def UpdateValues(self, row=-1, col=-1):
         if not self.grid.IsCellEditControlEnabled():
+            if row >= 0 and col >= 0:
+                # repaint just the modified cell (values are read on demand)
+                rect = self.grid.CellToRect(row, col)
+                rect.x, rect.y = self.grid.CalcScrolledPosition(rect.x, rect.y)
+                self.grid.GetGridWindow().RefreshRect(rect, False)
+                return
+            self._fmt_cache.clear()
             self.grid.BeginBatch()
             msg = wx.grid.GridTableMessage(self,
                 wx.grid.GRIDTABLE_REQUEST_VIEW_GET_VALUES,
@@ -178,19 +234,32 @@ class PlanSummaryTable(wx.grid.PyGridTableBase):
             #self.grid.ForceRefresh()
             self.grid.EndBatch()
 
+    def maybe_flush(self, force=False):
+        "Write back buffered changes (if forced or sync interval elapsed)"
+        if self.data is not None and (force or self._dirty):
+            if force or time.time() - self._last_flush > PSP_SYNC_INTERVAL:
+                self.data.sync()
+                self._dirty = False
+                self._last_flush = time.time()
+
     def Clear(self):
         self.data = None
+        self._dirty = False
+        self._fmt_cache = {}    # (phase, time) -> formatted cell value
 
     def Load(self, data):
         self.data = data
+        self._fmt_cache = {}
+        self._last_row = None
         self.UpdateValues()
 
         
 class DefectListCtrl(wx.ListCtrl, CheckListCtrlMixin, ListCtrlAutoWidthMixin):
-    "Defect recording log facilities"
+    "Defect recording log facilities (virtual list, rows read on demand)"
     def __init__(self, parent):
         wx.ListCtrl.__init__(self, parent, -1, 
-            style=wx.LC_REPORT | wx.LC_SINGLE_SEL | wx.LC_ALIGN_LEFT)
+            style=wx.LC_REPORT | wx.LC_VIRTUAL | wx.LC_SINGLE_SEL | 
+                  wx.LC_ALIGN_LEFT)
         ListCtrlAutoWidthMixin.__init__(self)
         CheckListCtrlMixin.__init__(self)
         #TextEditMixin.__init__(self)
@@ -211,7 +280,9 @@ class DefectListCtrl(wx.ListCtrl, CheckListCtrlMixin, ListCtrlAutoWidthMixin):
             "offset": (10, wx.LIST_FORMAT_RIGHT, 0),
             "uuid": (11, wx.LIST_FORMAT_RIGHT, 0),
             }
-        for col_key, col_def in sorted(self.col_defs.items(), key=lambda k: k[1][0]):
+        # sort the columns only once (by position), reused for each row:
+        self.col_order = sorted(self.col_defs.items(), key=lambda k: k[1][0])
+        for col_key, col_def in self.col_order:
             col_name = col_key.replace("_", " ").capitalize()
             i = col_def[0]
             col_fmt, col_size = col_def[1:3]
@@ -219,14 +290,26 @@ class DefectListCtrl(wx.ListCtrl, CheckListCtrlMixin, ListCtrlAutoWidthMixin):
             self.SetColumnWidth(i, col_size)
             if col_size == wx.LIST_AUTOSIZE:
                 self.setResizeColumn(i+1)
+        # reverse map: column position -> field name and its text getter
+        # (resolved once, the last field prevails if a position is repeated)
+        self.col_getters = {}
+        for col_key, col_def in self.col_order:
+            if col_key == 'fix_time':
+                getter = self.GetFixTimeText
+            else:
+                getter = self.GetFieldText
+            self.col_getters[col_def[0]] = col_key, getter
 
         self.Bind(wx.EVT_LIST_ITEM_SELECTED, self.OnItemSelected, self)
         self.Bind(wx.EVT_LIST_ITEM_DESELECTED, self.OnItemDeselected, self)
 
         self.selecteditemindex = None
-        self.key_map = {}  # list item data (defect_id) -> key (uuid)
+        self.key_map = []  # list item index (position) -> key (uuid)
+        self.fix_times = {}  # hot counters not stored yet: key -> fix time
         
         self.data = None
+        self._dirty = False
+        self._last_flush = time.time()
 
         # make a popup-menu
         self.menu = wx.Menu()
@@ -250,6 +333,7 @@ class DefectListCtrl(wx.ListCtrl, CheckListCtrlMixin, ListCtrlAutoWidthMixin):
 
     def __del__(self):
         if self.data is not None:
+            self.merge_fix_times()
             self.data.close()
 
     def AddItem(self, item, key=None):
@@ -265,11 +349,13 @@ class DefectListCtrl(wx.ListCtrl, CheckListCtrlMixin, ListCtrlAutoWidthMixin):
                     defect["lineno"] == item["lineno"] and 
                     defect["offset"] == item["offset"]):
                     key = defect['uuid']
-                    self.parent.psp_log_event("dup_defect", uuid=key, comment=str(item))
+                    comment = PSP_DEFECT_LOG_FORMAT % (defect["number"],
+                                    defect["type"], defect["inject_phase"])
+                    self.parent.psp_log_event("dup_defect", uuid=key,
+                                              comment=comment)
                     return
         if "checked" not in item:
             item["checked"] = False
-        index = self.InsertStringItem(sys.maxint, str(item["number"]))
         # calculate max number + 1
         if item['number'] is None:
             if self.data:
@@ -279,38 +365,66 @@ class DefectListCtrl(wx.ListCtrl, CheckListCtrlMixin, ListCtrlAutoWidthMixin):
                 item['number'] = 1
         # create a unique string key to store it
         if key is None:
-            key = str(uuid.uuid1())
+            key = uuid.uuid4().hex
             item['uuid'] = key
             self.data[key] = item
             self.data[key].save()
-            item = self.data[key]
             self.data.sync()
-            self.parent.psp_log_event("new_defect", uuid=key, comment=str(self.data[key]))
-        for col_key, col_def in self.col_defs.items():
-            val = item.get(col_key, "")
-            if col_key == 'fix_time':
-                val = pretty_time(val)
-            elif isinstance(val, str):
-                val = val.decode("utf8", "replace")
-            elif isinstance(val, unicode):
-                val = val
-            elif val is not None:
-                val = str(val)
-            else:
-                val = ""
-            self.SetStringItem(index, col_def[0], val)
-        self.key_map[item['defect_id']] = key
-        self.SetItemData(index, item['defect_id'])
-        if item["checked"]:
-            self.ToggleItem(index)
+            comment = PSP_DEFECT_LOG_FORMAT % (item.get("number"),
+                                item.get("type"), item.get("inject_phase"))
+            self.parent.psp_log_event("new_defect", uuid=key, comment=comment)
+        # just update the row count, the text will be fetched when displayed
+        self.key_map.append(key)
+        self.SetItemCount(len(self.key_map))
+
+    def OnGetItemText(self, index, col):
+        "Return the formatted value of a cell (called by wx for visible rows)"
+        if col not in self.col_getters:
+            return ""
+        col_key, getter = self.col_getters[col]
+        return getter(self.key_map[index], col_key)
+
+    def GetFieldText(self, key, col_key):
+        "Convert a stored defect field to unicode text"
+        val = self.data[key].get(col_key, "")
+        if isinstance(val, str):
+            val = val.decode("utf8", "replace")
+        elif isinstance(val, unicode):
+            val = val
+        elif val is not None:
+            val = str(val)
+        else:
+            val = ""
+        return val
+
+    def GetFixTimeText(self, key, col_key):
+        "Format the fix time (prefer the hot counter, if not merged back yet)"
+        val = self.fix_times.get(key)
+        if val is None:
+            val = self.data[key].get(col_key)
+        return pretty_time(val)
+
+    def OnGetItemImage(self, index):
+        "Return the checkbox image (0: unchecked, 1: checked) for the row"
+        return self.IsChecked(index) and 1 or 0
+
+    def IsChecked(self, index):
+        return bool(self.data[self.key_map[index]]["checked"])
+
+    def CheckItem(self, index, check=True):
+        "Mark or unmark an item (the state is kept in data, not in the image)"
+        if self.IsChecked(index) != check:
+            self.OnCheckItem(index, check)
+
+    def ToggleItem(self, index):
+        self.CheckItem(index, not self.IsChecked(index))
 
     def OnRightClick(self, event):
         self.PopupMenu(self.menu)
             
     def OnItemActivated(self, evt):
         #self.ToggleItem(evt.m_itemIndex)      
-        defect_id = long(self.GetItemData(evt.m_itemIndex))
-        key = self.key_map[defect_id]
+        key = self.key_map[evt.m_itemIndex]
         item = self.data[key]
         event = item["filename"], item["lineno"], item["offset"] or 0
         if item["filename"] and item["lineno"]:
@@ -322,32 +436,27 @@ class DefectListCtrl(wx.ListCtrl, CheckListCtrlMixin, ListCtrlAutoWidthMixin):
         "Change item status -fixed, wontfix-"
         wontfix = event.GetId() == ID_WONTFIX
         self.OnCheckItem(self.selected_index, True, wontfix)
-        self.ToggleItem(self.selected_index)
 
     # this is called by the base class when an item is checked/unchecked
     def OnCheckItem(self, index, flag, wontfix=False):
-        defect_id = long(self.GetItemData(index))
-        key = self.key_map[defect_id]
+        self.merge_fix_times()
+        key = self.key_map[index]
         item = self.data[key]
         title = item["number"]
         if item.get("checked") != flag:
             if wontfix:
-                item["fix_time"] = None
-                col_key = 'fix_time' # clean fix time (wontfix mark)
-                col_index = self.col_defs[col_key][0]
-                self.SetStringItem(index, col_index, "")
+                item["fix_time"] = None     # clean fix time (wontfix mark)
             if flag:
                 what = "checked"
                 col_key = 'remove_phase' # update phase when removed 
-                col_index = self.col_defs[col_key][0]
                 if not item[col_key]:
-                    phase = item[col_key] = self.parent.GetPSPPhase()
-                    self.SetStringItem(index, col_index, str(phase))
+                    item[col_key] = self.parent.GetPSPPhase()
             else:
                 what = "unchecked"
             self.parent.psp_log_event("%s_defect" % what, uuid=key)
             item["checked"] = flag
             self.data.sync()
+            self.RefreshItem(index)
 
     def OnKeyDown(self, event):
         key = event.GetKeyCode()
@@ -361,11 +470,16 @@ class DefectListCtrl(wx.ListCtrl, CheckListCtrlMixin, ListCtrlAutoWidthMixin):
 
     def OnDeleteItem(self, evt):
         if self.selected_index is not None:
-            defect_id = long(self.GetItemData(self.selected_index))
-            key = self.key_map[defect_id]
+            key = self.key_map.pop(self.selected_index)
+            self.fix_times.pop(key, None)
             del self.data[key]
-            self.DeleteItem(self.selected_index)
+            self.SetItemCount(len(self.key_map))
             self.data.sync()
+            # keep the defect being fixed (if any) pointing to the same row
+            if self.selecteditemindex == self.selected_index:
+                self.selecteditemindex = None
+            elif self.selecteditemindex > self.selected_index:
+                self.selecteditemindex -= 1
             # refresh new selected item
             if not self.data:
                 self.selected_index = None
@@ -382,8 +496,8 @@ class DefectListCtrl(wx.ListCtrl, CheckListCtrlMixin, ListCtrlAutoWidthMixin):
         dlg.Destroy()
             
     def OnEditItem(self, evt):
-        defect_id = long(self.GetItemData(self.selected_index))
-        key = self.key_map[defect_id]
+        self.merge_fix_times()
+        key = self.key_map[self.selected_index]
         item = self.data[key]
  
         dlg = DefectDialog(None, -1, "Edit Defect No. %s" % item['number'], 
@@ -391,35 +505,34 @@ class DefectListCtrl(wx.ListCtrl, CheckListCtrlMixin, ListCtrlAutoWidthMixin):
         dlg.CenterOnScreen()
         dlg.SetValue(item)
         if dlg.ShowModal() == wx.ID_OK:
-            item.update(dlg.GetValue())
+            values = dlg.GetValue()
+            # the timer kept counting while the dialog was open:
+            if "fix_time" in values:
+                self.fix_times.pop(key, None)   # the edited value prevails
+            else:
+                self.merge_fix_times()          # keep the counted time
+            item.update(values)
             self.UpdateItem(self.selected_index, item)
         self.data.sync()
 
     def UpdateItems(self):
         "Refresh all items at once"
-        # do a reverse map lookup for each item data -> index (position)
-        for index in range(self.GetItemCount()):
-            defect_id = long(self.GetItemData(index))
-            print "index, defect_id",  index, defect_id, self.key_map
-            key = self.key_map[defect_id]
-            item = self.data[key]
-            self.UpdateItem(index, item)
+        if self.key_map:
+            self.RefreshItems(0, len(self.key_map) - 1)
 
     def UpdateItem(self, index, item):
         "Refresh an item given the index and data"
-        for col_key, col_def in self.col_defs.items():
-            val = item.get(col_key, "")
-            if col_key == 'fix_time':
-                val = pretty_time(val)
-            elif val is not None:
-                val = str(val)
-            else:
-                val = ""
-            self.SetStringItem(index, col_def[0], val)
+        # values are read from data when the row is repainted
+        self.RefreshItem(index)
 
     def DeleteAllItems(self):
+        if self.data is not None:
+            self.merge_fix_times()
         self.data = None
+        self._dirty = False
         self.selected_index = None
+        self.selecteditemindex = None
+        self.key_map = []
         wx.ListCtrl.DeleteAllItems(self)
 
     def OnItemSelected(self, evt):
@@ -428,26 +541,47 @@ class DefectListCtrl(wx.ListCtrl, CheckListCtrlMixin, ListCtrlAutoWidthMixin):
     def OnItemDeselected(self, evt):
         self.selected_index = None
         
-    def count(self, phase):
+    def count(self, phase, delta=1):
         "Increment actual user time to fix selected defect"
         if self.selecteditemindex is not None:
             index = self.selecteditemindex
-            defect_id = long(self.GetItemData(index))
-            key = self.key_map[defect_id]
+            key = self.key_map[index]
             col_key = "fix_time"
-            col_index = self.col_defs[col_key][0]
             flag =  self.data[key]["checked"]
             if not flag:
-                value = self.data[key][col_key] + 1
-                self.data[key][col_key] = value
+                # only bump the hot counter, the defect record is not touched
+                value = self.fix_times.get(key)
+                if value is None:
+                    value = self.data[key][col_key] or 0
+                self.fix_times[key] = value + delta
+                self._dirty = True
+                self.RefreshItem(index)
+
+    def merge_fix_times(self):
+        "Write back the hot fix time counters into the defect records"
+        for key, value in self.fix_times.items():
+            if key in self.data:
+                self.data[key]["fix_time"] = value
+        self.fix_times.clear()
+
+    def maybe_flush(self, force=False):
+        "Write back buffered changes (if forced or sync interval elapsed)"
+        if self.data is not None and (force or self._dirty):
+            if force or time.time() - self._last_flush > PSP_SYNC_INTERVAL:
+                self.merge_fix_times()
                 self.data.sync()
-                self.SetStringItem(index, col_index, pretty_time(value))
+                self._dirty = False
+                self._last_flush = time.time()
 
     def Load(self, data):
         self.data = data
-        # refresh UI
-        for key, item in data.items():
-            self.AddItem(item, key)
+        # refresh UI (batch update, persisted items are not written back)
+        self.Freeze()
+        try:
+            for key, item in data.items():
+                self.AddItem(item, key)
+        finally:
+            self.Thaw()
         
 
 class DefectDialog(wx.Dialog):
@@ -474,23 +608,19 @@ class DefectDialog(wx.Dialog):
                                        style=wx.TE_MULTILINE)
         grid1.Add(self.description, 1, wx.EXPAND, 5)
 
-        self.types = sorted(PSP_DEFECT_TYPES.keys())
-        self.phases = phases = [""] + PSP_PHASES
-        types = ["%s: %s" % (k, PSP_DEFECT_TYPES[k]) for k in self.types]
-        
         label = wx.StaticText(self, -1, "Defect Type:")
         grid1.Add(label, 0, wx.ALIGN_LEFT, 5)
-        self.defect_type = wx.Choice(self, -1, choices=types, size=(80,-1))
+        self.defect_type = wx.Choice(self, -1, choices=PSP_DEFECT_TYPE_CHOICES, size=(80,-1))
         grid1.Add(self.defect_type, 1, wx.EXPAND, 5)
 
         label = wx.StaticText(self, -1, "Inject Phase:")
         grid1.Add(label, 0, wx.ALIGN_LEFT, 5)
-        self.inject_phase = wx.Choice(self, -1, choices=phases, size=(80,-1))
+        self.inject_phase = wx.Choice(self, -1, choices=PSP_PHASE_CHOICES, size=(80,-1))
         grid1.Add(self.inject_phase, 1, wx.EXPAND, 5)
 
         label = wx.StaticText(self, -1, "Remove Phase:")
         grid1.Add(label, 0, wx.ALIGN_LEFT, 5)
-        self.remove_phase = wx.Choice(self, -1, choices=phases, size=(80,-1))
+        self.remove_phase = wx.Choice(self, -1, choices=PSP_PHASE_CHOICES, size=(80,-1))
         grid1.Add(self.remove_phase, 1, wx.EXPAND, 5)
 
         label = wx.StaticText(self, -1, "Fix time:")
@@ -525,11 +655,11 @@ class DefectDialog(wx.Dialog):
         self.summary.SetValue(item.get("summary", ""))
         self.description.SetValue(item.get("description", ""))
         if 'type' in item:
-            self.defect_type.SetSelection(self.types.index(int(item['type'])))
+            self.defect_type.SetSelection(PSP_DEFECT_TYPE_INDEX[int(item['type'])])
         if 'inject_phase' in item:
-            self.inject_phase.SetSelection(self.phases.index(item['inject_phase']))
+            self.inject_phase.SetSelection(PSP_PHASE_CHOICE_INDEX[item['inject_phase']])
         if 'remove_phase' in item:
-            self.remove_phase.SetSelection(self.phases.index(item['remove_phase']))
+            self.remove_phase.SetSelection(PSP_PHASE_CHOICE_INDEX[item['remove_phase']])
         if 'fix_time' in item:
             self.fix_time.SetValue(pretty_time(item.get("fix_time", 0)))
         self.fix_defect.SetValue(item.get("fix_defect", "") or '')
@@ -537,12 +667,15 @@ class DefectDialog(wx.Dialog):
     def GetValue(self):
         item = {"summary": self.summary.GetValue(), 
                 "description": self.description.GetValue(), 
-                "type": self.types[self.defect_type.GetCurrentSelection()], 
-                "inject_phase": self.phases[self.inject_phase.GetCurrentSelection()],
-                "remove_phase": self.phases[self.remove_phase.GetCurrentSelection()], 
+                "type": PSP_DEFECT_TYPE_KEYS[self.defect_type.GetCurrentSelection()], 
+                "inject_phase": PSP_PHASE_CHOICES[self.inject_phase.GetCurrentSelection()],
+                "remove_phase": PSP_PHASE_CHOICES[self.remove_phase.GetCurrentSelection()], 
                 "fix_time": parse_time(self.fix_time.GetValue()), 
                 "fix_defect": self.fix_defect.GetValue(), 
                 }
+        # invalid fix time input: do not overwrite the stored value
+        if item["fix_time"] is None:
+            del item["fix_time"]
         return item
 
 
@@ -570,7 +703,10 @@ class PSPMixin(object):
 
         # text recording logs
         psp_event_log_filename = cfg.get("psp_event_log", "psp_event_log.txt")
-        self.psp_event_log_file = open(psp_event_log_filename, "a")
+        self.psp_event_log_file = open(psp_event_log_filename, "a",
+                                       PSP_LOG_BUFFER_SIZE)
+        self.psp_event_log_flushed = time.time()
+        self.psp_last_tick = time.time()
 
         self._current_psp_phase = None
         self.psp_metadata_cache = {}
@@ -732,6 +868,10 @@ class PSPMixin(object):
         self._mgr.Update()
 
     def set_current_psp_phase(self, phase):
+        if self._current_psp_phase != phase:
+            # account the pending time to the previous phase
+            self.psp_settle()
+            self.psp_flush(force=True)
         if self._current_psp_phase:
             print "Updating metadata", self._current_psp_phase, "->", phase
             self.UpdateMetadataPSP()
@@ -748,24 +888,25 @@ class PSPMixin(object):
 
     def SetPSPPhase(self, phase):
         if phase:
-            self.psp_phase_choice.SetSelection(PSP_PHASES.index(phase))
+            self.psp_phase_choice.SetSelection(PSP_PHASE_INDEX[phase])
         else:
             self.psp_phase_choice.SetSelection(len(PSP_PHASES))
         self.current_psp_phase = phase
 
     def GetPSPPhase(self):
+        # use the cached phase (updated by SetPSPPhase and OnPSPPhaseChoice)
+        return self._current_psp_phase or ''
+
+    def OnPSPPhaseChoice(self, event):
         phase = self.psp_phase_choice.GetCurrentSelection()
         if phase >= 0 and phase < len(PSP_PHASES):
-            return PSP_PHASES[phase]
+            phase = PSP_PHASES[phase]
         else:
-            return ''
-
-    def OnPSPPhaseChoice(self, event):
+            phase = ''
         # store current phase in config file
-        phase = self.GetPSPPhase()
         wx.GetApp().config.set('PSP', 'current_phase', phase)
         wx.GetApp().write_config()
-        self.current_psp_phase = self.GetPSPPhase()
+        self.current_psp_phase = phase
 
     def OnPhasePSP(self, event):
         "Event to change the current PSP phase"
@@ -778,7 +919,10 @@ class PSPMixin(object):
     def OnStartPSP(self, event):
         # check if the user manually clicked the button (not the camera sensor):
         self.psp_automatic_stopwatch = event is None
-        self.timer.Start(1000)
+        # elapsed time is measured from the clock (timer events could be late)
+        if not self.timer.IsRunning():
+            self.psp_last_tick = time.time()
+        self.timer.Start(PSP_TIMER_INTERVAL)
         self.psp_log_event("start")
         self.task_toolbar.EnableTool(ID_START, False)
         self.task_toolbar.EnableTool(ID_PAUSE, True)
@@ -795,6 +939,7 @@ class PSPMixin(object):
             self.OnStartPSP(None)
         # ignore interrupt state change if already being counted (paused):
         if self.psp_interruption is None:
+            self.psp_settle()
             self.psp_interruption = 0
             self.psp_log_event("pausing!", comment=message)
             self.task_toolbar.ToggleTool(ID_PAUSE, True)
@@ -811,6 +956,7 @@ class PSPMixin(object):
             self.OnStartPSP(None)
         # ignore resume state change if already being counted (resumed):
         if self.psp_interruption is not None:
+            self.psp_settle()
             self.psp_interruption = None
             phase = self.GetPSPPhase()
             if message:
@@ -823,6 +969,7 @@ class PSPMixin(object):
     def OnPausePSP(self, event):
         # check if the user manually clicked the button (not the camera sensor):
         self.psp_automatic_stopwatch = event is None
+        self.psp_flush(force=True)
         # check if we are in a interruption delta or not:
         if self.psp_interruption is not None:
             # don't ask for a message if interruption was detected automatically
@@ -842,7 +989,9 @@ class PSPMixin(object):
     def OnStopPSP(self, event):
         # check if the user manually clicked the button (not the camera sensor):
         self.psp_automatic_stopwatch = event is None
+        self.psp_settle()
         self.timer.Stop()
+        self.psp_flush(force=True)
         self.psp_log_event("stop")
         if self.psp_interruption: 
             self.OnPausePSP(event)
@@ -853,50 +1002,85 @@ class PSPMixin(object):
         self.show_psp_plan_pane()
                     
     def TimerHandler(self, event):
+        # write back buffered data only from time to time (not every tick)
+        self.psp_flush()
+        # calculate whole seconds elapsed (keep the fraction for next time)
+        now = time.time()
+        delta = int(now - self.psp_last_tick)
+        if delta < 0 or delta > PSP_MAX_TICK:
+            # clock stepped backwards or the computer was asleep: resync
+            # (do not book hours of sleep to the current phase or defect)
+            self.psp_last_tick = now
+            delta = max(0, min(delta, PSP_MAX_TICK))
+        else:
+            self.psp_last_tick += delta
+        if not delta:
+            return
         # increment interruption delta time counter (if any)
         if self.psp_interruption is not None:
-            self.psp_interruption += 1
+            self.psp_interruption += delta
+        # idle tick: nothing else to account without an active task
+        if not self.task_id:
+            return
         # ignore actual time or interruptions if the IDE is not "focused"
         active = wx.GetApp().IsActive() or self.executing
         # update task total time
-        if self.task_id and active and not self.psp_interruption:
-            self.tick_task_context()
+        if active and not self.psp_interruption:
+            self.tick_task_context(delta)
         phase = self.GetPSPPhase()
-        if phase and self.task_id and not self.task_suspended:
-            # register variation and calculate total elapsed time
-            psp_times = self.psptimetable.count(phase, self.psp_interruption,
-                                                active)
-            if not psp_times:
-                return
-            actual = psp_times.get('actual') or 0
-            interruption = psp_times.get('interruption') or 0
-            plan = float(psp_times.get('plan') or 0)
-            total = float(max(plan, (actual + interruption)))
-            # Draw progress bar accordingly
-            if total and plan:
-                self.psp_gauge.SetRange(total)
-                self.psp_gauge.SetValue([interruption, interruption + actual])
-                # TODO: properly use effects (incremental Update):
-                self.psp_gauge.Refresh()
-                # NOTE: percentage could be bigger than > 100 % (plan < elapsed)
-                percentage = int((actual + interruption) / plan * 100.)
-                if percentage < 75:
-                    colour = wx.BLUE
-                elif percentage <= 100:
-                    colour = wx.NamedColour("ORANGE")
-                else:
-                    colour = wx.RED
-                self.psp_gauge.SetDrawValue(font=wx.SMALL_FONT, colour=colour,
-                                            formatString="%d %%" % percentage)
+        if not phase or self.task_suspended:
+            return
+        # register variation and calculate total elapsed time
+        psp_times = self.psptimetable.count(phase, self.psp_interruption,
+                                            active, delta)
+        if not psp_times:
+            return
+        actual = psp_times.get('actual') or 0
+        interruption = psp_times.get('interruption') or 0
+        plan = float(psp_times.get('plan') or 0)
+        total = float(max(plan, (actual + interruption)))
+        # Draw progress bar accordingly
+        if total and plan:
+            self.psp_gauge.SetRange(total)
+            self.psp_gauge.SetValue([interruption, interruption + actual])
+            # TODO: properly use effects (incremental Update):
+            self.psp_gauge.Refresh()
+            # NOTE: percentage could be bigger than > 100 % (plan < elapsed)
+            percentage = int((actual + interruption) / plan * 100.)
+            if percentage < 75:
+                colour = wx.BLUE
+            elif percentage <= 100:
+                colour = wx.NamedColour("ORANGE")
             else:
-                self.psp_gauge.SetRange(100)
-                self.psp_gauge.SetValue([0, 0])
-            if not self.psp_interruption:
-                self.psp_defect_list.count(phase)
-            
+                colour = wx.RED
+            self.psp_gauge.SetDrawValue(font=wx.SMALL_FONT, colour=colour,
+                                        formatString="%d %%" % percentage)
+        else:
+            self.psp_gauge.SetRange(100)
+            self.psp_gauge.SetValue([0, 0])
+        if not self.psp_interruption:
+            self.psp_defect_list.count(phase, delta)
+
+    def psp_settle(self):
+        "Account the time elapsed since the last timer event (if running)"
+        if self.timer.IsRunning():
+            self.TimerHandler(None)
+
+    def psp_flush(self, force=False):
+        "Store buffered time and defect counters, and the event log"
+        self.psptimetable.maybe_flush(force)
+        self.psp_defect_list.maybe_flush(force)
+        now = time.time()
+        if force or now - self.psp_event_log_flushed > PSP_LOG_FLUSH_INTERVAL:
+            self.psp_event_log_file.flush()
+            self.psp_event_log_flushed = now
+
     def __del__(self):
-        self.OnStop(None)
-        close(self.psp_event_log_file)
+        # don't replay the UI stop handler (the frame could be destroyed)
+        try:
+            self.psp_flush(force=True)
+        finally:
+            self.psp_event_log_file.close()
         
     def OnDefectPSP(self, event):
         "Manually create a new PSP defect"
@@ -964,11 +1148,13 @@ class PSPMixin(object):
     def psp_log_event(self, event, uuid="-", comment=""):
         phase = self.GetPSPPhase()
         timestamp = str(datetime.datetime.now())
-        msg = PSP_EVENT_LOG_FORMAT % {'timestamp': timestamp, 'phase': phase, 
-            'event': event, 'comment': comment, 'uuid': uuid}
-        print msg
-        self.psp_event_log_file.write("%s\r\n" % msg)
-        self.psp_event_log_file.flush()
+        msg = PSP_EVENT_LOG_FORMAT % (timestamp, uuid, phase, event, comment)
+        if DEBUG: print msg,
+        self.psp_event_log_file.write(msg)
+        # if the stopwatch is stopped, no timer event will flush the log later
+        if not self.timer.IsRunning():
+            self.psp_event_log_file.flush()
+            self.psp_event_log_flushed = time.time()
 
     def deactivate_task(self):
         # store current data:
@@ -985,6 +1171,8 @@ class PSPMixin(object):
             self.OnStartPSP(None)
 
     def suspend_task(self):
+        # account the pending time before the task is marked as suspended
+        self.psp_settle()
         super(PSPMixin, self).suspend_task()
         self.OnStopPSP(None)
         self.psp_automatic_stopwatch = False
@@ -1006,8 +1194,7 @@ class PSPMixin(object):
         if self.task_id:
             task = self.db["task"][self.task_id]
             
-            self.psp_defect_list.data.sync()
-            self.psptimetable.data.sync()
+            self.psp_flush(force=True)
             
             if self.psp_rpc_client:
                 pass  ##self.psp_save_project_rpc(task["task_name"]):
@@ -405,14 +405,14 @@ class TaskMixin(object):
                 if DEBUG: print "restoring fold", filename, fold['start_lineno']
                 editor.SetFold(**fold)
 
-    def tick_task_context(self):
-        "Update task context file timings"
+    def tick_task_context(self, delta=1):
+        "Update task context file timings (delta: elapsed seconds)"
         if self.active_child and not self.task_suspended:
             #lineno = self.active_child.GetCurrentLine()
             filename = self.active_child.GetFilename()
             ctx = self.get_task_context(filename)
             if DEBUG: print "TICKING", filename, ctx, ctx['total_time']
-            ctx['total_time'] = (ctx['total_time'] or 0) + 1
+            ctx['total_time'] = (ctx['total_time'] or 0) + delta
         # it will be saved on task deactivation (to avoid excesive db access)
     
     def get_task_context_file_relevance(self, filename):